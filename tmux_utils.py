@@ -17,49 +17,596 @@ Tmux Orchestrator 工具类 - Tmux 会话和窗口管理
 最后更新：2024年
 """
 
+import array
+import asyncio
+import hashlib
+import io
+import os
+import pickle
+import queue
+import re
+import selectors
 import subprocess
+import sys
 import json
+import tempfile
 import time
-from typing import List, Dict, Optional, Tuple
-from dataclasses import dataclass
+import threading
+import weakref
+from functools import lru_cache
+from typing import Any, Callable, Hashable, List, Dict, NamedTuple, Optional, Set, Tuple, Union
 from datetime import datetime
 
-@dataclass
-class TmuxWindow:
+# 可选依赖：orjson 是 C 扩展，序列化大量窗口内容时比标准库 json 快得多；
+# 未安装时回退到标准库 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+class TmuxWindow(NamedTuple):
     """
     Tmux 窗口数据结构
     
     用于表示单个 tmux 窗口的状态信息，包含窗口的基本属性
     和当前活动状态。
     
+    使用不可变的 NamedTuple：实例没有 __dict__，内存占用更小，
+    并且可以直接比较和哈希（例如作为字典键对比前后两次快照）。
+    
     属性说明:
         session_name (str): 所属会话名称
         window_index (int): 窗口索引号，从 0 开始
         window_name (str): 窗口显示名称
         active (bool): 是否为当前活动窗口
+        window_id (str): tmux 分配的持久窗口 ID（如 "@3"），窗口重新编号后保持不变
+        activity (int): 窗口最近一次产生输出的时间（Unix 时间戳，秒）
     """
     session_name: str
     window_index: int
     window_name: str
     active: bool
+    window_id: str = ""
+    activity: int = 0
     
-@dataclass
-class TmuxSession:
+class TmuxSession(NamedTuple):
     """
     Tmux 会话数据结构
     
     表示完整的 tmux 会话信息，包含会话下的所有窗口
-    和会话的连接状态。
+    和会话的连接状态。与 TmuxWindow 一样是不可变的 NamedTuple。
     
     属性说明:
         name (str): 会话名称，必须在系统中唯一
-        windows (List[TmuxWindow]): 该会话下的所有窗口列表
+        windows (Tuple[TmuxWindow, ...]): 该会话下的所有窗口
         attached (bool): 会话是否被客户端连接（活跃状态）
     """
     name: str
-    windows: List[TmuxWindow]
+    windows: Tuple[TmuxWindow, ...]
     attached: bool
 
+# tmux -F 输出中的字段分隔符（ASCII US），不会出现在会话名、窗口名等标识符中，
+# 配合固定的 maxsplit 解析，不会因为名称中包含 ':' 而解析错位
+_FIELD_SEP = "\x1f"
+
+# list-windows -a 的输出格式：一行一个窗口，同时携带所属会话的客户端列表（用于判断连接状态）
+# 窗口名可能包含任意字符，因此放在最后一个字段
+_WINDOWS_FORMAT = _FIELD_SEP.join(
+    ["#{session_name}", "#{session_attached_list}", "#{window_index}", "#{window_id}", "#{window_activity}",
+     "#{pane_id}", "#{window_active}", "#{window_panes}", "#{window_layout}", "#{window_name}"])
+
+# display-message 查询单个窗口详细信息时使用的格式
+_WINDOW_INFO_FORMAT = _FIELD_SEP.join(
+    ["#{window_name}", "#{window_active}", "#{window_panes}", "#{window_layout}"])
+
+# 没有终端的客户端（如本模块的控制模式客户端）在 tmux 中被命名为 "client-<pid>"，
+# 它们不代表有用户在查看会话，判断会话连接状态时不计入
+_HEADLESS_CLIENT_PREFIX = "client-"
+
+# 表示会话或窗口结构发生变化的控制模式通知，收到后会话列表缓存和持久化快照立即失效
+# （%session-changed 只表示控制客户端自身连接到了某个会话，不在其中）
+_STRUCTURE_EVENTS = (
+    "%window-add", "%window-close", "%window-renamed", "%window-pane-changed",
+    "%unlinked-window-add", "%unlinked-window-close", "%unlinked-window-renamed",
+    "%session-renamed", "%sessions-changed", "%session-window-changed",
+    "%client-session-changed", "%client-detached", "%layout-change",
+)
+
+# 批量捕获时插入在每个窗口内容之前的分隔行（ASCII RS，不会出现在捕获的文本中）
+_CAPTURE_DELIMITER = "\x1e"
+
+
+def _tmux_server_socket() -> str:
+    """
+    返回 tmux 客户端将要连接的服务端套接字路径
+    
+    与 tmux 自身的选择规则一致：在 tmux 内部运行时使用 $TMUX 中记录的套接字，
+    否则使用 $TMUX_TMPDIR（默认 /tmp）下的 tmux-<uid>/default。
+    """
+    socket_path = os.environ.get("TMUX", "").split(",")[0]
+    if socket_path:
+        return socket_path
+    return os.path.join(os.environ.get("TMUX_TMPDIR") or "/tmp", f"tmux-{os.getuid()}", "default")
+
+
+def _snapshot_path(server: str) -> str:
+    """
+    返回指定 tmux 服务端的持久化状态快照路径，用于跨进程（多次 CLI 调用之间）的热启动
+    
+    文件名带上用户 ID 和服务端套接字的摘要，避免多用户共享临时目录时互相读取，
+    也避免同一用户的不同 tmux 服务端读到彼此的会话。
+    """
+    digest = hashlib.sha1(server.encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f"tmux_orch_snapshot-{os.getuid()}-{digest}.pkl")
+
+
+class SnapshotTable:
+    """
+    按列存储（SoA）的窗口快照表
+    
+    一次 `tmux list-windows -a` 的结果按字段存放在平行的列中，第 i 行的各列
+    共同描述第 i 个窗口。数值列使用 array.array、布尔列使用 bytearray，
+    不需要为每个窗口创建对象；只有调用 sessions() 时才构建 TmuxSession /
+    TmuxWindow 层次结构。
+    
+    两次快照的对比（changed_rows）只需逐项比较 activity_counters 和
+    active_pane_ids 列，得到自上次快照以来有新输出或切换了活动窗格的窗口，
+    即需要重新捕获内容的窗口。
+    
+    列说明:
+        session_names (List[str]): 所属会话名称
+        attached_mask (bytearray): 所属会话是否被有终端的客户端连接（1/0）
+        window_indices (array('i')): 窗口索引
+        window_ids (List[str]): 持久窗口 ID（如 "@3"）
+        activity_counters (array('q')): 窗口最近一次产生输出的时间（Unix 时间戳，秒）
+        active_pane_ids (List[str]): 窗口当前活动窗格的 ID（如 "%5"），capture-pane 捕获的就是这个窗格
+        active_mask (bytearray): 是否为所属会话的活动窗口（1/0）
+        pane_counts (array('i')): 窗格数量
+        layouts (List[str]): 窗口布局描述
+        window_names (List[str]): 窗口名称
+    """
+    
+    def __init__(self):
+        self.session_names: List[str] = []
+        self.attached_mask = bytearray()
+        self.window_indices = array.array('i')
+        self.window_ids: List[str] = []
+        self.activity_counters = array.array('q')
+        self.active_pane_ids: List[str] = []
+        self.active_mask = bytearray()
+        self.pane_counts = array.array('i')
+        self.layouts: List[str] = []
+        self.window_names: List[str] = []
+        self._sessions: Optional[Tuple[TmuxSession, ...]] = None
+    
+    @classmethod
+    def parse(cls, output: str) -> 'SnapshotTable':
+        """从 _WINDOWS_FORMAT 格式的 tmux 输出构建快照表"""
+        table = cls()
+        # 逐行解析窗口信息，字段顺序见 _WINDOWS_FORMAT
+        for line in output.split('\n'):
+            if not line:  # 跳过空行
+                continue
+            (session_name, attached, window_index, window_id, activity,
+             pane_id, active, panes, layout, window_name) = line.split(_FIELD_SEP, 9)
+            table.session_names.append(session_name)
+            table.attached_mask.append(any(client and not client.startswith(_HEADLESS_CLIENT_PREFIX)
+                                           for client in attached.split(',')))
+            table.window_indices.append(int(window_index))
+            table.window_ids.append(window_id)
+            table.activity_counters.append(int(activity))
+            table.active_pane_ids.append(pane_id)
+            table.active_mask.append(active == '1')
+            table.pane_counts.append(int(panes))
+            table.layouts.append(layout)
+            table.window_names.append(window_name)
+        return table
+    
+    def __len__(self) -> int:
+        return len(self.window_ids)
+    
+    def sessions(self) -> List[TmuxSession]:
+        """
+        按会话分组构建 TmuxSession 列表
+        
+        分组结果会被记住，每次调用返回一个新的列表副本；其中的 TmuxSession /
+        TmuxWindow 不可变，调用方修改返回的列表不会影响之后的调用。
+        """
+        if self._sessions is None:
+            # 以会话名为键分组，dict 保持插入顺序，与 tmux 的输出顺序一致
+            grouped: Dict[str, List[TmuxWindow]] = {}
+            attached: Dict[str, bool] = {}
+            for i, session_name in enumerate(self.session_names):
+                attached.setdefault(session_name, bool(self.attached_mask[i]))
+                grouped.setdefault(session_name, []).append(TmuxWindow(
+                    session_name=session_name,
+                    window_index=self.window_indices[i],
+                    window_name=self.window_names[i],
+                    active=bool(self.active_mask[i]),
+                    window_id=self.window_ids[i],
+                    activity=self.activity_counters[i]
+                ))
+            self._sessions = tuple(TmuxSession(name=name, windows=tuple(windows), attached=attached[name])
+                                   for name, windows in grouped.items())
+        return list(self._sessions)
+    
+    def changed_rows(self, previous: Optional['SnapshotTable']) -> List[int]:
+        """
+        返回相对 previous 有变化的行号：新出现的窗口、活动时间不同的窗口，
+        或活动窗格发生切换的窗口（select-pane 不会改变活动时间，但会改变捕获的内容）
+        
+        窗口集合没有变化时（最常见的情况）直接逐项比较 activity_counters 和
+        active_pane_ids 列；否则按 window_id 对齐后再比较。previous 为 None 时
+        所有行都视为有变化。
+        """
+        if previous is None:
+            return list(range(len(self)))
+        if previous.window_ids == self.window_ids:
+            return [i for i in range(len(self))
+                    if previous.activity_counters[i] != self.activity_counters[i]
+                    or previous.active_pane_ids[i] != self.active_pane_ids[i]]
+        previous_state = {window_id: (activity, pane_id) for window_id, activity, pane_id
+                          in zip(previous.window_ids, previous.activity_counters, previous.active_pane_ids)}
+        return [i for i, window_id in enumerate(self.window_ids)
+                if previous_state.get(window_id) != (self.activity_counters[i], self.active_pane_ids[i])]
+
+
+def _parse_window_info(output: str) -> Optional[Dict]:
+    """解析 _WINDOW_INFO_FORMAT 格式的输出，输出为空时返回 None"""
+    line = output.rstrip('\n')
+    # 目标窗口不存在时 display-message 仍然成功，只是所有字段都为空
+    if not line.strip(_FIELD_SEP):
+        return None
+    parts = line.split(_FIELD_SEP, 3)
+    return {
+        "name": parts[0],
+        "active": parts[1] == '1',
+        "panes": int(parts[2]),
+        "layout": parts[3],
+    }
+
+
+def _parse_batched_captures(output: str) -> List[str]:
+    """按 _CAPTURE_DELIMITER 分隔行切分批量捕获的输出，返回按顺序排列的各窗口内容"""
+    sections = output.split(_CAPTURE_DELIMITER + '\n')
+    # 第一个分隔行之前没有内容
+    return sections[1:]
+
+
+class _Flight:
+    """一次正在进行中的计算，供同一个键的并发调用者共享结果"""
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.ok = False
+        self.value: Any = None
+
+
+class _TTLCache:
+    """
+    带过期时间（TTL）和 singleflight 去重的内存缓存
+    
+    条目以 {key: (expires_at, value)} 的形式保存，过期时间基于
+    time.monotonic()，不受系统时钟调整影响。同一个键在同一时刻只会
+    有一个调用者真正执行计算（启动 tmux 子进程），其余并发调用者会
+    阻塞等待并共享这次计算的结果。
+    
+    键的约定:
+        - 会话列表: "__sessions__"
+        - 窗口内容: (session_name, window_index, num_lines)
+    
+    注意:
+        - 计算函数抛出的异常不会被缓存，等待者会重新发起计算
+        - 计算期间如果发生了失效操作，本次结果只返回给调用者，不写入缓存，
+          避免把失效前读到的旧内容重新放回缓存
+    
+    成本感知:
+        cost_aware=True 时只缓存"重新计算比维护缓存更昂贵"的结果：计算耗时
+        必须超过固定阈值 _MIN_CACHE_COST 才会写入。廉价的结果（例如控制模式下
+        空闲 shell 的窗口）因此不会占用缓存内存。非成本感知的写入（如
+        "__sessions__"）总是写入。
+    """
+    
+    # 成本感知写入的最低计算耗时（秒），约为控制模式下一次 capture-pane 往返的耗时；
+    # 低于此值的结果重新获取已足够便宜，不值得占用缓存
+    _MIN_CACHE_COST = 0.0005
+    
+    def __init__(self):
+        self._entries: Dict[Hashable, Tuple[float, Any]] = {}
+        self._inflight: Dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+        self._generation = 0  # 每次失效操作递增，用于丢弃过期的在途结果
+    
+    def get_or_compute(self, key: Hashable, ttl: float, compute: Callable[[], Any], cost_aware: bool = False) -> Any:
+        """
+        返回 key 对应的缓存值；未命中时调用 compute()，并发调用者共享同一次计算
+        
+        cost_aware 为 True 时，只有 compute() 的耗时超过 _MIN_CACHE_COST 才写入缓存
+        """
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and time.monotonic() < entry[0]:
+                    return entry[1]
+                flight = self._inflight.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._inflight[key] = _Flight()
+                    generation = self._generation
+            
+            if not leader:
+                # 已有调用者在执行同一个计算，等待其完成后共享结果
+                flight.done.wait()
+                if flight.ok:
+                    return flight.value
+                continue  # 领头者失败，重新竞争执行
+            
+            try:
+                start = time.perf_counter()
+                value = compute()
+                cost = time.perf_counter() - start
+                flight.value = value
+                flight.ok = True
+            finally:
+                with self._lock:
+                    if flight.ok and generation == self._generation:
+                        self._store(key, ttl, value, cost if cost_aware else None)
+                    del self._inflight[key]
+                flight.done.set()
+            return value
+    
+    def get(self, key: Hashable) -> Optional[Any]:
+        """返回未过期的缓存值，未命中时返回 None（不会触发计算）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() < entry[0]:
+                return entry[1]
+            return None
+    
+    @property
+    def generation(self) -> int:
+        """当前的失效代数，每次失效操作递增"""
+        return self._generation
+    
+    def put(self, key: Hashable, ttl: float, value: Any, cost: Optional[float] = None,
+            generation: Optional[int] = None) -> bool:
+        """
+        直接写入一个缓存条目，用于批量获取的结果回填缓存
+        
+        传入 cost（获取该值的耗时，秒）时按成本感知策略决定是否写入；传入
+        generation（开始获取该值之前的 self.generation）时，如果期间发生过失效
+        操作则不写入，避免把失效前读到的旧内容重新放回缓存。返回是否已写入
+        """
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return False
+            return self._store(key, ttl, value, cost)
+    
+    def _store(self, key: Hashable, ttl: float, value: Any, cost: Optional[float]) -> bool:
+        """写入条目；传入 cost 时，低于 _MIN_CACHE_COST 的结果不写入（调用方需持有锁）"""
+        if cost is not None and cost <= self._MIN_CACHE_COST:
+            return False  # 重新计算比维护缓存更便宜，不值得缓存
+        self._entries[key] = (time.monotonic() + ttl, value)
+        return True
+    
+    def discard(self, key: Hashable) -> None:
+        """删除单个条目，同时让该键的在途计算结果不再写入缓存"""
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(key, None)
+    
+    def invalidate(self, session_name: Optional[str] = None) -> None:
+        """使缓存失效：不指定会话时清空全部条目，否则只删除该会话的窗口内容"""
+        with self._lock:
+            self._generation += 1
+            if session_name is None:
+                self._entries.clear()
+                return
+            self._sweep(lambda k: k[0] == session_name)
+    
+    def invalidate_window(self, session_name: str, window_index: int) -> None:
+        """删除指定窗口的所有内容缓存（键前缀为 (session_name, window_index) 的条目）"""
+        prefix = (session_name, window_index)
+        with self._lock:
+            self._generation += 1
+            self._sweep(lambda k: k[:2] == prefix)
+    
+    def _sweep(self, match: Callable[[tuple], bool]) -> None:
+        """删除所有匹配的元组键（调用方需持有锁）"""
+        for key in [k for k in self._entries if isinstance(k, tuple) and match(k)]:
+            del self._entries[key]
+
+
+def _weak_event_handler(method: Callable[[str], None]) -> Callable[[str], None]:
+    """包装绑定方法，使回调只弱引用其对象，后台线程不会阻止对象被回收"""
+    ref = weakref.WeakMethod(method)
+    
+    def handler(line: str) -> None:
+        bound = ref()
+        if bound is not None:
+            bound(line)
+    return handler
+
+
+def _quote_tmux_arg(arg: str) -> str:
+    """按 tmux 命令语法把一个参数包裹在双引号中，转义其中的特殊字符"""
+    escaped = (arg.replace('\\', '\\\\').replace('"', '\\"').replace('$', '\\$')
+               .replace('\n', '\\n').replace('\r', '\\r'))
+    return f'"{escaped}"'
+
+
+class _TmuxControlClient:
+    """
+    tmux 控制模式（tmux -C）的长连接客户端
+    
+    启动一个常驻的 `tmux -C attach-session` 客户端进程，连接到一个已有的会话：
+    不创建任何会话，也不改变窗口大小（ignore-size）或接收窗格输出（no-output）。
+    之后所有命令都以文本行的形式写入其 stdin，再从 stdout 读取以
+    %begin / %end（失败时为 %error）包围的响应块。相比每条命令都 fork+exec
+    一个新的 tmux 客户端，省去了进程创建和连接服务端的开销。
+    
+    协议要点（参见 tmux(1) CONTROL MODE）:
+        - 每一行命令对应一个响应块，块首尾行携带相同的时间戳和命令编号
+        - 不在响应块内、以 % 开头的行是异步通知（如 %window-add）
+        - 写入空行会让客户端断开，因此绝不能发送空命令
+    
+    stdout 由一个后台线程独占读取：线程通过 selectors 等待数据，把本客户端
+    命令的响应块按顺序放入响应队列，把异步通知交给 on_event 回调。
+    
+    线程安全：写入命令和按顺序取回响应在同一把锁内完成。
+    """
+    
+    # 等待 stdout 可读的超时时间，后台线程借此定期检查是否已被关闭
+    _SELECT_TIMEOUT = 0.5
+    
+    def __init__(self, session: str, on_event: Optional[Callable[[str], None]] = None):
+        """
+        参数:
+            session (str): 要连接的已有会话（名称或 $id）；该会话被关闭时客户端随之退出
+            on_event (Optional[Callable[[str], None]]): 异步通知的回调，在后台线程中调用
+        """
+        self._lock = threading.Lock()
+        self._responses: "queue.Queue[Optional[Tuple[bool, str]]]" = queue.Queue()
+        self._on_event = on_event
+        self._closed = False
+        self._proc = subprocess.Popen(
+            ["tmux", "-C", "attach-session", "-t", session, "-f", "no-output,ignore-size"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self._reader = threading.Thread(target=self._read_loop, name="tmux-control-reader", daemon=True)
+        self._reader.start()
+    
+    @property
+    def alive(self) -> bool:
+        return not self._closed and self._proc.poll() is None
+    
+    def _lines(self):
+        """逐行产出 stdout 的内容，使用 selectors 等待数据，连接关闭后结束"""
+        fd = self._proc.stdout.fileno()
+        buffer = b""
+        with selectors.DefaultSelector() as selector:
+            selector.register(fd, selectors.EVENT_READ)
+            while not self._closed:
+                if not selector.select(self._SELECT_TIMEOUT):
+                    continue
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    return  # EOF：tmux 客户端已退出
+                buffer += chunk
+                *lines, buffer = buffer.split(b'\n')
+                for line in lines:
+                    yield line.decode("utf-8", errors="replace")
+    
+    def _read_loop(self) -> None:
+        """后台线程：分发响应块和异步通知"""
+        block: Optional[List[str]] = None  # 当前正在读取的响应块内容
+        guard: List[str] = []  # 当前响应块的时间戳和命令编号，用于识别配对的结束行
+        ours = False  # 当前响应块是否由本客户端的命令产生（标志位为 1）
+        try:
+            for line in self._lines():
+                if block is None:
+                    if line.startswith("%begin "):
+                        fields = line.split(' ')
+                        block, guard, ours = [], fields[1:3], fields[3:4] == ['1']
+                    elif line.startswith("%exit"):
+                        return
+                    elif line.startswith('%') and self._on_event is not None:
+                        self._on_event(line)
+                elif line.startswith(("%end ", "%error ")) and line.split(' ')[1:3] == guard:
+                    if ours:
+                        output = '\n'.join(block) + '\n' if block else ''
+                        self._responses.put((line.startswith("%end "), output))
+                    block = None
+                else:
+                    block.append(line)
+        finally:
+            self._closed = True
+            self._responses.put(None)  # 唤醒等待响应的调用者
+    
+    def run_many(self, commands: List[List[str]]) -> List[Tuple[bool, str]]:
+        """
+        流水线式地执行多条命令：一次性写入全部命令行，再依次取回各自的响应
+        
+        每条命令独立成功或失败，一条失败不会影响其他命令。命令写入后连接才断开时，
+        无法知道 tmux 是否已经执行了这些命令（例如 send-keys 可能已经输入），
+        因此不抛出异常，而是把尚未收到响应的命令报告为失败，避免调用方重发。
+        
+        异常:
+            ConnectionError: 控制客户端已断开，命令尚未写入，可以安全地改用其他方式执行
+        """
+        payload = ''.join(' '.join([args[0]] + [_quote_tmux_arg(a) for a in args[1:]]) + '\n'
+                          for args in commands)
+        with self._lock:
+            if not self.alive:
+                raise ConnectionError("tmux control client exited")
+            results: List[Tuple[bool, str]] = []
+            try:
+                self._proc.stdin.write(payload.encode("utf-8"))
+                self._proc.stdin.flush()
+            except OSError:
+                self._closed = True  # 写入中途断开，部分命令可能已被 tmux 读取
+            else:
+                for _ in commands:
+                    response = self._responses.get()
+                    if response is None:
+                        self._responses.put(None)  # 保留断开标记，后续调用同样立即失败
+                        break
+                    results.append(response)
+            lost = (False, "tmux control client exited before responding\n")
+            return results + [lost] * (len(commands) - len(results))
+    
+    def close(self) -> None:
+        """断开控制客户端（关闭 stdin 即可让 tmux 客户端退出）"""
+        with self._lock:
+            self._closed = True
+            try:
+                self._proc.stdin.close()
+            except OSError:
+                pass
+            self._proc.wait()
+        self._reader.join()
+
+
+@lru_cache(maxsize=128)
+def _compile_window_pattern(pattern: str) -> "re.Pattern[str]":
+    """编译窗口名正则表达式（不区分大小写），同一个模式只编译一次"""
+    return re.compile(pattern, re.IGNORECASE)
+
+
+class _WindowNameIndex:
+    """
+    窗口名称的小写三元组（trigram）索引，用于不区分大小写的子串查找
+    
+    对每个窗口名的小写形式，记录其中每个长度为 3 的子串出现在哪些窗口中。
+    查询时先对查询串的所有三元组取交集得到候选窗口，再用 `in` 验证，
+    避免每次查询都对所有窗口名重新调用 lower() 并逐个比较。
+    查询串短于 3 个字符时无法使用三元组，退化为对预先小写化的名称逐个比较。
+    """
+    
+    def __init__(self, table: SnapshotTable):
+        self.table = table  # 建立索引时使用的快照表，用于判断索引是否过期
+        # 位置与快照表的行号一一对应
+        self._targets: List[Tuple[str, int]] = list(zip(table.session_names, table.window_indices))
+        self._names: List[str] = [name.lower() for name in table.window_names]
+        self._trigrams: Dict[str, Set[int]] = {}
+        for pos, name in enumerate(self._names):
+            for i in range(len(name) - 2):
+                self._trigrams.setdefault(name[i:i + 3], set()).add(pos)
+    
+    def search(self, query: str) -> List[Tuple[str, int]]:
+        """返回名称包含 query（不区分大小写）的窗口，顺序与会话列表一致"""
+        query = query.lower()
+        if len(query) < 3:
+            candidates = range(len(self._names))
+        else:
+            grams = sorted((self._trigrams.get(query[i:i + 3], set()) for i in range(len(query) - 2)), key=len)
+            candidates = sorted(set.intersection(*grams))
+        return [self._targets[pos] for pos in candidates if query in self._names[pos]]
+    
+    def search_regex(self, pattern: "re.Pattern[str]") -> List[Tuple[str, int]]:
+        """返回名称与正则表达式匹配（re.search）的窗口，顺序与会话列表一致"""
+        return [target for target, name in zip(self._targets, self.table.window_names) if pattern.search(name)]
+
+
 class TmuxOrchestrator:
     """
     Tmux 编排器主类
@@ -87,10 +634,189 @@ class TmuxOrchestrator:
         配置项说明:
             safety_mode (bool): 启用安全模式，需要用户确认敏感操作
             max_lines_capture (int): 单次捕获窗口内容的最大行数，防止内存溢出
+            capture_cache_ttl (float): 窗口内容缓存的有效期（秒）
+            sessions_cache_ttl (float): 会话列表缓存的有效期（秒）
+            snapshot_max_age (float): 持久化状态快照的有效期（秒），在此时间内的
+                get_all_windows_status 调用（包括新进程）直接复用快照
+            use_control_mode (bool): 通过常驻的 tmux 控制模式连接发送命令，
+                而不是每条命令启动一个 tmux 进程
+            event_sessions_cache_ttl (float): 控制模式连接可用时会话列表缓存的有效期（秒）；
+                此时会话和窗口的结构变化由 tmux 通知主动使缓存失效，TTL 只作为兜底
+        
+        控制模式说明:
+            连接在第一次执行 tmux 命令时建立，以控制客户端的身份连接到最近使用的
+            已有会话，不会创建会话，因此不带 -t 的 tmux 命令仍然作用于原来的会话。
+            该客户端没有终端，不计入会话的 attached 状态。tmux 服务端未运行时
+            不会为此启动服务端，而是回退到逐条执行 tmux 命令；连接的会话被关闭时
+            同样回退，并在稍后重新连接。
+            连接建立后，后台线程监听 tmux 的 %window-add、%window-close、
+            %window-renamed、%sessions-changed 等通知，按事件使缓存失效，而不是轮询。
+            窗口的新输出不会产生此类通知，因此窗口内容缓存仍按 capture_cache_ttl 过期，
+            get_tmux_sessions 返回的 activity 字段也可能滞后。
         """
         self.safety_mode = True  # 默认启用安全模式，需要确认才能发送命令
         self.max_lines_capture = 1000  # 限制捕获的最大行数，避免内存问题
+        self.capture_cache_ttl = 2.0  # 窗口内容变化快，缓存时间较短
+        self.sessions_cache_ttl = 5.0  # 会话和窗口结构变化较少，缓存时间稍长
+        self.snapshot_max_age = 5.0  # 持久化快照的有效期，与会话列表缓存保持一致
+        self.use_control_mode = True  # 默认通过控制模式长连接执行 tmux 命令
+        self.event_sessions_cache_ttl = 30.0  # 有事件通知时，会话列表缓存只需很长的兜底 TTL
+        self._ctl: Optional[_TmuxControlClient] = None
+        self._ctl_retry_at = 0.0  # 控制模式不可用时，下一次尝试建立连接的时间
+        self._cache = _TTLCache()
+        # 上次状态快照使用的快照表及各窗口捕获的内容，活动时间未变化的窗口无需重新捕获
+        # (获取时的缓存失效代数, 快照表)：代数与当前不一致时说明期间发生过失效，不能再用于对比
+        self._last_table: Optional[Tuple[int, SnapshotTable]] = None
+        self._last_content: Dict[str, Tuple[int, str]] = {}  # window_id -> (num_lines, 内容)
+        self._untrusted_ids: Set[str] = set()  # 活动时间不足以判断内容是否变化的窗口
+        self._name_index: Optional[_WindowNameIndex] = None  # find_window_by_name 使用的名称索引
+        self._snapshot_id = 0  # 名称索引每次重建时递增，作为查询结果缓存的一部分键
+        # 按 (规范化的查询, 快照编号) 缓存查询结果，监控循环中的重复查询直接复用
+        self._find_cached = lru_cache(maxsize=128)(self._find_in_index)
+        # 等待批量确认后发送的命令队列：(会话名, 窗口索引, 按键序列, 是否追加回车)
+        self._pending: List[Tuple[str, int, str, bool]] = []
+    
+    def invalidate(self, session_name: Optional[str] = None) -> None:
+        """
+        使缓存的 tmux 状态失效
+        
+        参数:
+            session_name (Optional[str]): 只清除该会话的窗口内容缓存；
+                为 None 时清除全部缓存（包括会话列表）
+        """
+        self._cache.invalidate(session_name)
+        self._last_table = None
+        self._discard_snapshot()
+    
+    def _invalidate_window(self, session_name: str, window_index: int) -> None:
+        """窗口被写入后丢弃其缓存内容，并让下一次快照重新捕获"""
+        self._cache.invalidate_window(session_name, window_index)
+        # 丢弃上次的快照表会让下一次快照重新捕获所有窗口，代价很小（只是多一次批量捕获）
+        self._last_table = None
+        self._discard_snapshot()
+    
+    def _control(self) -> Optional[_TmuxControlClient]:
+        """返回可用的控制模式客户端，必要时建立连接；不可用时返回 None"""
+        if not self.use_control_mode:
+            return None
+        if self._ctl is not None and self._ctl.alive:
+            return self._ctl
+        self._ctl = None
+        if time.monotonic() < self._ctl_retry_at:
+            return None
+        # 连接失败后一段时间内不再重试，避免每条命令都额外付出一次尝试的代价
+        self._ctl_retry_at = time.monotonic() + self.sessions_cache_ttl
+        # 只连接已经在运行的服务端，不能为了建立控制连接而启动一个新的 tmux 服务端
+        result = subprocess.run(["tmux", "list-sessions", "-F", f"#{{session_activity}}{_FIELD_SEP}#{{session_id}}"],
+                                capture_output=True, text=True)
+        if result.returncode != 0 or not result.stdout.strip():
+            return None
+        # 连接最近使用的会话：连接会刷新会话的使用时间，选择它不会改变 tmux 的默认目标会话
+        sessions = [line.split(_FIELD_SEP) for line in result.stdout.splitlines() if line]
+        session_id = max(sessions, key=lambda fields: int(fields[0]))[1]
+        try:
+            self._ctl = _TmuxControlClient(session_id, on_event=_weak_event_handler(self._on_tmux_event))
+        except OSError:
+            return None
+        return self._ctl
+    
+    def _on_tmux_event(self, line: str) -> None:
+        """
+        处理控制模式的异步通知（在后台读取线程中调用）
+        
+        会话或窗口结构变化时删除会话列表缓存、上次的快照表和持久化快照，
+        下一次 get_all_windows_status 会重新查询 tmux；窗口关闭或切换活动窗格时，
+        还会根据缓存的快照表找到该窗口，丢弃其内容缓存。
+        """
+        if not line.startswith(_STRUCTURE_EVENTS):
+            return
+        if line.startswith(("%window-close ", "%unlinked-window-close ", "%window-pane-changed ")):
+            window_id = line.split(' ')[1]
+            table = self._cache.get("__sessions__")
+            if table is not None and window_id in table.window_ids:
+                row = table.window_ids.index(window_id)
+                self._cache.invalidate_window(table.session_names[row], table.window_indices[row])
+        self._cache.discard("__sessions__")
+        self._last_table = None
+        self._discard_snapshot()
+    
+    def _ctl_send_many(self, commands: List[List[str]]) -> List[Tuple[bool, str]]:
+        """
+        执行多条 tmux 命令，返回每条命令的 (是否成功, 输出)
+        
+        优先通过控制模式连接流水线执行；连接不可用时逐条启动 tmux 进程执行。
+        命令写入控制连接后连接才断开时不会回退重发（send-keys 等命令不是幂等的），
+        尚未收到响应的命令报告为失败。
+        """
+        ctl = self._control()
+        if ctl is not None:
+            try:
+                return ctl.run_many(commands)
+            except ConnectionError:
+                pass  # 命令尚未写入时连接已断开，回退到逐条执行；下一次调用会重新建立连接
+        results = []
+        for args in commands:
+            result = subprocess.run(["tmux", *args], capture_output=True, text=True)
+            results.append((result.returncode == 0, result.stdout if result.returncode == 0 else result.stderr))
+        return results
+    
+    def _ctl_send(self, *args: str) -> str:
+        """
+        执行一条 tmux 命令并返回其输出
         
+        异常:
+            subprocess.CalledProcessError: 命令执行失败时抛出，与 subprocess.run(check=True) 一致
+        """
+        ok, output = self._ctl_send_many([list(args)])[0]
+        if not ok:
+            raise subprocess.CalledProcessError(1, ["tmux", *args], "", output)
+        return output
+    
+    def close(self) -> None:
+        """断开控制模式连接（如果已建立）"""
+        if self._ctl is not None:
+            self._ctl.close()
+            self._ctl = None
+    
+    def _load_snapshot(self, num_lines: int) -> Optional[Dict]:
+        """
+        读取当前 tmux 服务端的持久化状态快照
+        
+        只有文件属于当前用户、修改时间在 snapshot_max_age 之内，并且服务端套接字
+        和捕获行数都与本次请求一致时才返回快照，否则返回 None。
+        """
+        server = _tmux_server_socket()
+        path = _snapshot_path(server)
+        try:
+            st = os.stat(path)
+            # 只信任当前用户自己写入的文件，避免反序列化他人放置的 pickle
+            if st.st_uid != os.getuid() or time.time() - st.st_mtime >= self.snapshot_max_age:
+                return None
+            with open(path, "rb") as f:
+                snapshot_server, snapshot_lines, status = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError):
+            return None
+        return status if snapshot_server == server and snapshot_lines == num_lines else None
+    
+    def _save_snapshot(self, num_lines: int, status: Dict) -> None:
+        """原子地写入状态快照（先写临时文件再重命名），写入失败时静默忽略"""
+        server = _tmux_server_socket()
+        path = _snapshot_path(server)
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump((server, num_lines, status), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+    
+    def _discard_snapshot(self) -> None:
+        """删除当前 tmux 服务端的持久化状态快照，下一次 get_all_windows_status 会重新查询 tmux"""
+        try:
+            os.remove(_snapshot_path(_tmux_server_socket()))
+        except OSError:
+            pass  # 文件不存在或无权删除
+    
     def get_tmux_sessions(self) -> List[TmuxSession]:
         """
         获取所有 tmux 会话和窗口信息
@@ -99,8 +825,8 @@ class TmuxOrchestrator:
         所有活跃会话的完整状态信息。
         
         执行步骤:
-        1. 获取所有会话列表及其连接状态
-        2. 对每个会话获取其下所有窗口信息
+        1. 通过一次 `tmux list-windows -a` 获取所有会话下的全部窗口
+        2. 按会话名称对窗口行进行分组
         3. 构建完整的会话-窗口层次结构
         
         返回:
@@ -112,49 +838,29 @@ class TmuxOrchestrator:
         注意:
             - 此方法只读取状态，不会修改任何 tmux 配置
             - 返回的信息是调用时刻的快照，不会自动更新
+            - 无论有多少会话，都只启动一个 tmux 子进程（避免 N+1 调用）
+            - 结果会缓存 sessions_cache_ttl 秒，并发调用者共享同一次 tmux 调用
+        - 内部以 SnapshotTable 按列保存，TmuxSession 对象只在此处按需构建一次
         """
+        table = self._get_table()
+        return table.sessions() if table is not None else []
+    
+    def _get_table(self) -> Optional[SnapshotTable]:
+        """返回（可能来自缓存的）窗口快照表，tmux 命令失败时打印错误并返回 None"""
+        # 控制模式连接可用时，结构变化会通过事件使缓存失效，可以使用更长的兜底 TTL
+        events = self._ctl is not None and self._ctl.alive
+        ttl = self.event_sessions_cache_ttl if events else self.sessions_cache_ttl
         try:
-            # 获取所有会话的名称和连接状态
-            # -F 参数指定输出格式，#{} 是 tmux 的变量语法
-            sessions_cmd = ["tmux", "list-sessions", "-F", "#{session_name}:#{session_attached}"]
-            sessions_result = subprocess.run(sessions_cmd, capture_output=True, text=True, check=True)
-            
-            sessions = []
-            # 逐行解析会话信息，格式为 "session_name:0/1"
-            for line in sessions_result.stdout.strip().split('\n'):
-                if not line:  # 跳过空行
-                    continue
-                session_name, attached = line.split(':')
-                
-                # 获取指定会话下的所有窗口信息
-                # -t 指定目标会话，-F 设置输出格式
-                windows_cmd = ["tmux", "list-windows", "-t", session_name, "-F", "#{window_index}:#{window_name}:#{window_active}"]
-                windows_result = subprocess.run(windows_cmd, capture_output=True, text=True, check=True)
-                
-                windows = []
-                # 解析窗口信息，格式为 "index:name:0/1"
-                for window_line in windows_result.stdout.strip().split('\n'):
-                    if not window_line:  # 跳过空行
-                        continue
-                    window_index, window_name, window_active = window_line.split(':')
-                    windows.append(TmuxWindow(
-                        session_name=session_name,
-                        window_index=int(window_index),
-                        window_name=window_name,
-                        active=window_active == '1'
-                    ))
-                
-                # 创建会话对象，attached 状态：'1'=连接，'0'=分离
-                sessions.append(TmuxSession(
-                    name=session_name,
-                    windows=windows,
-                    attached=attached == '1'  # 字符串 '1' 转换为布尔值 True
-                ))
-            
-            return sessions
+            return self._cache.get_or_compute("__sessions__", ttl, self._list_windows)
         except subprocess.CalledProcessError as e:
             print(f"Error getting tmux sessions: {e}")
-            return []
+            return None
+    
+    def _list_windows(self) -> SnapshotTable:
+        """执行 tmux 命令并解析为快照表，失败时抛出 CalledProcessError"""
+        # 一次性获取所有会话的全部窗口，以及窗口所属会话的连接状态
+        # -a 表示列出所有会话的窗口，-F 参数指定输出格式，#{} 是 tmux 的变量语法
+        return SnapshotTable.parse(self._ctl_send("list-windows", "-a", "-F", _WINDOWS_FORMAT))
     
     def capture_window_content(self, session_name: str, window_index: int, num_lines: int = 50) -> str:
         """
@@ -176,6 +882,11 @@ class TmuxOrchestrator:
             - 防止内存溢出和系统负载过高
             - 如果命令执行失败，返回错误信息而非抛出异常
             
+        缓存:
+            - 结果按 (会话, 窗口, 行数) 缓存 capture_cache_ttl 秒
+            - 只缓存耗时超过固定阈值（约 0.5ms）的捕获，廉价的捕获每次直接重新执行
+            - 并发捕获同一窗口时只会启动一个 tmux 子进程
+            
         典型用法:
             # 获取最近50行输出
             content = orchestrator.capture_window_content("ai-session", 0)
@@ -188,32 +899,30 @@ class TmuxOrchestrator:
             num_lines = self.max_lines_capture
             
         try:
-            # capture-pane: 捕获窗格内容
-            # -t: 指定目标 (session:window)
-            # -p: 输出到 stdout 而不是文件
-            # -S: 指定开始行数，负数表示从末尾向前数
-            cmd = ["tmux", "capture-pane", "-t", f"{session_name}:{window_index}", "-p", "-S", f"-{num_lines}"]
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-            return result.stdout
+            # 短时间内对同一窗口的重复捕获直接复用缓存结果
+            return self._cache.get_or_compute(
+                (session_name, window_index, num_lines), self.capture_cache_ttl,
+                lambda: self._capture_pane(session_name, window_index, num_lines), cost_aware=True)
         except subprocess.CalledProcessError as e:
             return f"Error capturing window content: {e}"
     
-    def get_window_info(self, session_name: str, window_index: int) -> Dict:
-        """Get detailed information about a specific window"""
+    def _capture_pane(self, session_name: str, window_index: int, num_lines: int) -> str:
+        """执行 capture-pane 并返回窗口内容，失败时抛出 CalledProcessError"""
+        # capture-pane: 捕获窗格内容
+        # -t: 指定目标 (session:window)
+        # -p: 输出到 stdout 而不是文件
+        # -S: 指定开始行数，负数表示从末尾向前数
+        return self._ctl_send("capture-pane", "-t", f"{session_name}:{window_index}", "-p", "-S", f"-{num_lines}")
+    
+    def get_window_info(self, session_name: str, window_index: int, num_lines: int = 50) -> Dict:
+        """Get detailed information about a specific window, including its last num_lines of content"""
         try:
-            cmd = ["tmux", "display-message", "-t", f"{session_name}:{window_index}", "-p", 
-                   "#{window_name}:#{window_active}:#{window_panes}:#{window_layout}"]
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-            
-            if result.stdout.strip():
-                parts = result.stdout.strip().split(':')
-                return {
-                    "name": parts[0],
-                    "active": parts[1] == '1',
-                    "panes": int(parts[2]),
-                    "layout": parts[3],
-                    "content": self.capture_window_content(session_name, window_index)
-                }
+            output = self._ctl_send("display-message", "-t", f"{session_name}:{window_index}", "-p", _WINDOW_INFO_FORMAT)
+            
+            info = _parse_window_info(output)
+            if info is not None:
+                info["content"] = self.capture_window_content(session_name, window_index, num_lines)
+                return info
         except subprocess.CalledProcessError as e:
             return {"error": f"Could not get window info: {e}"}
     
@@ -237,6 +946,7 @@ class TmuxOrchestrator:
             - 在安全模式下会显示要执行的操作并请求确认
             - 用户必须输入 'yes' 才能继续执行
             - 如果用户拒绝或命令失败，返回 False
+            - 发送成功后会清除该窗口的内容缓存，后续捕获总能看到最新输出
             
         支持的按键格式:
             - 普通文本：直接输入字符
@@ -260,8 +970,9 @@ class TmuxOrchestrator:
                 return False
         
         try:
-            cmd = ["tmux", "send-keys", "-t", f"{session_name}:{window_index}", keys]
-            subprocess.run(cmd, check=True)
+            self._ctl_send("send-keys", "-t", f"{session_name}:{window_index}", keys)
+            # 窗口内容已被改变，丢弃该窗口的缓存，避免后续读取到旧输出
+            self._invalidate_window(session_name, window_index)
             return True
         except subprocess.CalledProcessError as e:
             print(f"Error sending keys: {e}")
@@ -305,20 +1016,88 @@ class TmuxOrchestrator:
             return False
         # 发送回车键执行命令，C-m 是 tmux 中回车键的表示法
         try:
-            cmd = ["tmux", "send-keys", "-t", f"{session_name}:{window_index}", "C-m"]
-            subprocess.run(cmd, check=True)
+            self._ctl_send("send-keys", "-t", f"{session_name}:{window_index}", "C-m")
+            # 命令开始执行后窗口输出会继续变化，再次丢弃该窗口的缓存
+            self._invalidate_window(session_name, window_index)
             return True
         except subprocess.CalledProcessError as e:
             print(f"Error sending Enter key: {e}")
             return False
     
-    def get_all_windows_status(self) -> Dict:
+    def queue(self, session_name: str, window_index: int, keys: str, enter: bool = True) -> None:
+        """
+        将一条命令加入待发送队列，等待 flush() 统一确认和发送
+        
+        参数:
+            session_name (str): 目标会话名称
+            window_index (int): 目标窗口索引
+            keys (str): 要发送的按键序列或命令文本
+            enter (bool): 是否在按键后追加回车执行，默认 True（等同 send_command_to_window）
+        """
+        self._pending.append((session_name, window_index, keys, enter))
+    
+    def flush(self, confirm: bool = True) -> bool:
+        """
+        一次性确认并发送队列中的全部命令
+        
+        在安全模式下，逐条调用 send_command_to_window 需要对每条命令分别确认。
+        批量脚本可以先用 queue() 排队，再调用 flush()：所有待发送命令只展示一次，
+        用户只需确认一次即可全部发送。
+        
+        参数:
+            confirm (bool): 是否需要用户确认，默认 True
+            
+        返回:
+            bool: 全部命令是否都发送成功；队列为空时返回 True
+            
+        注意:
+            - 用户拒绝时整个队列被丢弃，不会发送任何命令
+            - 命令按入队顺序依次发送，某条失败后剩余命令不再发送
+            
+        使用示例:
+            for cmd in ["cd /home/user", "python script.py"]:
+                orchestrator.queue("automation", 0, cmd)
+            orchestrator.flush()
+        """
+        pending, self._pending = self._pending, []
+        if not pending:
+            return True
+        
+        # 安全检查：整批命令只请求一次确认
+        if self.safety_mode and confirm:
+            print(f"SAFETY CHECK: About to send {len(pending)} command(s):")
+            for session_name, window_index, keys, enter in pending:
+                print(f"  {session_name}:{window_index} <- '{keys}'{' + Enter' if enter else ''}")
+            response = input("Confirm? (yes/no): ")
+            if response.lower() != 'yes':  # 必须输入完整的 'yes' 才能继续
+                print("Operation cancelled")
+                return False
+        
+        for session_name, window_index, keys, enter in pending:
+            try:
+                # 同一次 send-keys 调用中连同回车键（C-m）一起发送
+                args = ["send-keys", "-t", f"{session_name}:{window_index}", keys]
+                if enter:
+                    args.append("C-m")
+                self._ctl_send(*args)
+            except subprocess.CalledProcessError as e:
+                print(f"Error sending keys: {e}")
+                return False
+            finally:
+                self._invalidate_window(session_name, window_index)
+        return True
+    
+    def get_all_windows_status(self, num_lines: int = 50) -> Dict:
         """
         获取所有会话中所有窗口的完整状态信息
         
         这是一个综合性的状态收集方法，为系统监控和分析提供完整的数据快照。
         包含会话信息、窗口详情和实时内容。
         
+        参数:
+            num_lines (int): 每个窗口捕获的行数，默认50行；只需要末尾几行时
+                传入更小的值，可以减少 tmux 的工作量和管道传输的数据量
+        
         返回:
             Dict: 包含以下结构的状态字典:
             {
@@ -330,6 +1109,7 @@ class TmuxOrchestrator:
                         "windows": [
                             {
                                 "index": 窗口索引,
+                                "id": "持久窗口 ID（如 @3）",
                                 "name": "窗口名",
                                 "active": true/false,
                                 "info": {详细窗口信息，包含内容}
@@ -346,52 +1126,211 @@ class TmuxOrchestrator:
         - 历史状态记录和比较
         
         性能考虑:
-        - 此方法会调用多个 tmux 命令，可能耗时较长
-        - 在高频调用场景下建议添加缓存机制
+        - 无论窗口有多少，只调用两次 tmux：一次获取元数据，一次批量捕获内容
+        - 自上次快照以来没有新输出的窗口（按 window_id、活动时间和活动窗格判断）不会重新捕获
+        - 窗口内容经过短时缓存，高频调用时不会重复捕获
         - 窗口内容捕获受 max_lines_capture 限制
+        - 结果会持久化到临时目录，snapshot_max_age 秒内的再次调用（包括新的
+          CLI 进程）直接返回该快照，不启动任何 tmux 子进程
         """
-        sessions = self.get_tmux_sessions()
+        status = self._load_snapshot(num_lines)
+        if status is not None:
+            return status
+        
+        # 在查询 tmux 之前记下失效代数：查询期间控制模式事件线程可能使缓存失效，
+        # 此时本次结果不能写回缓存、快照表和持久化快照
+        generation = self._cache.generation
+        try:
+            # 一次 list-windows -a 获取全部窗口的元数据（替代每个窗口一次 display-message）
+            table = self._list_windows()
+            # 刚获取的元数据同时刷新会话列表缓存
+            self._cache.put("__sessions__", self.sessions_cache_ttl, table, generation=generation)
+        except subprocess.CalledProcessError as e:
+            print(f"Error getting tmux sessions: {e}")
+            table = SnapshotTable()
+        
         status = {
             "timestamp": datetime.now().isoformat(),
             "sessions": []
         }
+        sessions: Dict[str, Dict] = {}  # 会话名 -> 会话数据，保持 tmux 的输出顺序
+        infos: List[Dict] = []  # 与快照表的行一一对应的窗口详细信息
         
-        # 遍历所有会话，构建完整的状态数据结构
-        for session in sessions:
-            session_data = {
-                "name": session.name,
-                "attached": session.attached,
-                "windows": []  # 初始化空的窗口列表
-            }
-            
-            # 为每个窗口获取详细信息（包括内容快照）
-            for window in session.windows:
-                window_info = self.get_window_info(session.name, window.window_index)
-                window_data = {
-                    "index": window.window_index,
-                    "name": window.window_name,
-                    "active": window.active,
-                    "info": window_info  # 包含窗口内容和详细信息
+        for i, session_name in enumerate(table.session_names):
+            session_data = sessions.get(session_name)
+            if session_data is None:
+                session_data = sessions[session_name] = {
+                    "name": session_name,
+                    "attached": bool(table.attached_mask[i]),
+                    "windows": []  # 初始化空的窗口列表
                 }
-                session_data["windows"].append(window_data)
+                status["sessions"].append(session_data)
             
-            status["sessions"].append(session_data)
+            info = {
+                "name": table.window_names[i],
+                "active": bool(table.active_mask[i]),
+                "panes": table.pane_counts[i],
+                "layout": table.layouts[i],
+            }
+            session_data["windows"].append({
+                "index": table.window_indices[i],
+                "id": table.window_ids[i],  # 持久窗口 ID，可用于跨快照对比同一个窗口
+                "name": table.window_names[i],
+                "active": bool(table.active_mask[i]),
+                "info": info  # 包含窗口内容和详细信息
+            })
+            infos.append(info)
         
+        # 对比上次的快照表，只有活动时间或活动窗格发生变化（或无法据此判断）的窗口需要重新捕获，
+        # 其余窗口直接复用上次捕获的内容
+        last = self._last_table
+        changed = set(table.changed_rows(last[1] if last is not None and last[0] == generation else None))
+        pending = []
+        for i, window_id in enumerate(table.window_ids):
+            last = self._last_content.get(window_id)
+            if i in changed or window_id in self._untrusted_ids or last is None or last[0] != num_lines:
+                pending.append(i)
+            else:
+                infos[i]["content"] = last[1]
+        
+        # 一次 tmux 调用批量捕获其余窗口的内容（替代每个窗口一次 capture-pane）
+        # window_activity 只精确到秒：只有活动时间早于捕获开始的那一秒，才能保证之后的
+        # 任何输出都会让活动时间发生变化，此时记录的活动时间才可以用来跳过下一次捕获
+        capture_second = int(time.time())
+        contents = self._capture_windows_batch(
+            [(table.session_names[i], table.window_indices[i]) for i in pending], num_lines)
+        for i, content in zip(pending, contents):
+            window_id = table.window_ids[i]
+            infos[i]["content"] = content
+            self._last_content[window_id] = (num_lines, content)
+            if table.activity_counters[i] < capture_second and not content.startswith("Error capturing window content"):
+                self._untrusted_ids.discard(window_id)
+            else:
+                self._untrusted_ids.add(window_id)
+        
+        # 清理已经关闭的窗口的记录
+        live_ids = set(table.window_ids)
+        self._untrusted_ids &= live_ids
+        for window_id in [w for w in self._last_content if w not in live_ids]:
+            del self._last_content[window_id]
+        self._last_table = (generation, table)
+        
+        if self._cache.generation == generation:
+            self._save_snapshot(num_lines, status)
+            # 事件线程的删除可能发生在上面的检查之后、写入之前，写入后再检查一次
+            if self._cache.generation != generation:
+                self._discard_snapshot()
         return status
     
-    def find_window_by_name(self, window_name: str) -> List[Tuple[str, int]]:
-        """Find windows by name across all sessions"""
-        sessions = self.get_tmux_sessions()
-        matches = []
+    def _capture_windows_batch(self, targets: List[Tuple[str, int]], num_lines: int = 50) -> List[str]:
+        """
+        在一次 tmux 调用中捕获多个窗口的内容
         
-        # 在所有会话和窗口中搜索匹配的窗口名称
-        for session in sessions:
-            for window in session.windows:
-                # 使用不区分大小写的部分匹配
-                if window_name.lower() in window.window_name.lower():
-                    matches.append((session.name, window.window_index))  # 返回 (session, window_index) 元组
+        控制模式下，所有 capture-pane 命令一次性写入控制连接，再依次读取响应。
+        否则利用 tmux 的命令序列（以 ';' 分隔的多条命令由同一个 tmux 客户端
+        依次执行），在每个 capture-pane 之前输出一行分隔符，然后按顺序切分。
+        无论窗口有多少，都最多启动一个 tmux 子进程。
         
-        return matches
+        参数:
+            targets (List[Tuple[str, int]]): 要捕获的 (会话名, 窗口索引) 列表
+            num_lines (int): 每个窗口捕获的行数
+            
+        返回:
+            List[str]: 与 targets 一一对应的窗口内容
+            
+        注意:
+            - 命中缓存的窗口不会再次捕获，捕获结果按平摊到每个窗口的耗时回填到缓存
+            - tmux 在某条命令失败后会停止执行剩余命令（例如窗口在列出后被关闭），
+              此时未完成的窗口会回退到逐个调用 capture_window_content
+        """
+        num_lines = min(num_lines, self.max_lines_capture)
+        generation = self._cache.generation  # 捕获期间窗口被关闭或修改时，结果不写回缓存
+        contents: List[Optional[str]] = [self._cache.get((session_name, window_index, num_lines))
+                                         for session_name, window_index in targets]
+        pending = [i for i, content in enumerate(contents) if content is None]
+        if not pending:
+            return contents
+        
+        start = time.perf_counter()
+        ctl = self._control()
+        if ctl is not None:
+            # 控制模式下流水线执行所有 capture-pane，每条命令独立成功或失败
+            try:
+                results = ctl.run_many([["capture-pane", "-t", f"{session_name}:{window_index}", "-p", "-S", f"-{num_lines}"]
+                                        for session_name, window_index in (targets[i] for i in pending)])
+            except ConnectionError:
+                results = []  # 连接已断开，全部交给下面的逐个捕获处理
+            sections = []
+            for ok, output in results:
+                if not ok:
+                    break  # 失败的窗口及其之后的窗口交给回退逻辑处理
+                sections.append(output)
+        else:
+            cmd = ["tmux"]
+            for i in pending:
+                session_name, window_index = targets[i]
+                if len(cmd) > 1:
+                    cmd.append(";")
+                cmd += ["display-message", "-p", _CAPTURE_DELIMITER, ";",
+                        "capture-pane", "-t", f"{session_name}:{window_index}", "-p", "-S", f"-{num_lines}"]
+            try:
+                output = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+                sections = _parse_batched_captures(output)
+            except subprocess.CalledProcessError as e:
+                # 最后一段属于失败的那条 capture-pane，不可信，交给回退逻辑处理
+                sections = _parse_batched_captures(e.stdout or "")[:-1]
+        # 把批量调用的总耗时平摊到每个窗口，作为成本感知缓存的依据
+        cost = (time.perf_counter() - start) / len(pending)
+        
+        for i, section in zip(pending, sections):
+            session_name, window_index = targets[i]
+            self._cache.put((session_name, window_index, num_lines), self.capture_cache_ttl, section, cost,
+                            generation=generation)
+            contents[i] = section
+        
+        # 批量调用中途失败时，剩余窗口逐个捕获（会返回各自的错误信息）
+        for i in pending[len(sections):]:
+            session_name, window_index = targets[i]
+            contents[i] = self.capture_window_content(session_name, window_index, num_lines)
+        
+        return contents
+    
+    def find_window_by_name(self, window_name: Union[str, "re.Pattern[str]"], regex: bool = False) -> List[Tuple[str, int]]:
+        """
+        Find windows by name across all sessions
+        
+        参数:
+            window_name: 字符串时按不区分大小写的子串匹配；
+                已编译的正则表达式按 re.search 匹配（大小写规则由其自身的 flags 决定）
+            regex (bool): 为 True 时把字符串 window_name 当作不区分大小写的正则表达式
+            
+        返回:
+            List[Tuple[str, int]]: 匹配窗口的 (session, window_index) 列表
+            
+        使用示例:
+            orchestrator.find_window_by_name("claude")
+            orchestrator.find_window_by_name(r"^(dev|test)-\d+$", regex=True)
+        """
+        table = self._get_table()
+        if table is None:
+            return []
+        
+        # 快照表来自缓存时复用已建立的索引，只有缓存刷新后才重建
+        if self._name_index is None or self._name_index.table is not table:
+            self._name_index = _WindowNameIndex(table)
+            self._snapshot_id += 1
+        
+        if isinstance(window_name, str):
+            query = _compile_window_pattern(window_name) if regex else window_name.lower()
+        else:
+            query = window_name
+        return list(self._find_cached(query, self._snapshot_id))
+    
+    def _find_in_index(self, query: Union[str, "re.Pattern[str]"], snapshot_id: int) -> Tuple[Tuple[str, int], ...]:
+        """在当前名称索引中查找（结果由 _find_cached 按 snapshot_id 缓存）"""
+        if isinstance(query, str):
+            return tuple(self._name_index.search(query))
+        return tuple(self._name_index.search_regex(query))
     
     def create_monitoring_snapshot(self) -> str:
         """
@@ -424,37 +1363,173 @@ class TmuxOrchestrator:
         - 在问题发生时立即生成快照保存现场
         - 可配合日志系统自动化监控
         """
-        status = self.get_all_windows_status()
+        # 报告只展示每个窗口最后10行，因此只向 tmux 请求这么多历史行
+        status = self.get_all_windows_status(num_lines=10)
         
         # Format for Claude consumption
-        snapshot = f"Tmux Monitoring Snapshot - {status['timestamp']}\n"
-        snapshot += "=" * 50 + "\n\n"
+        # 使用 StringIO 逐段写入，避免在循环中反复拼接字符串
+        buf = io.StringIO()
+        buf.write(f"Tmux Monitoring Snapshot - {status['timestamp']}\n")
+        buf.write("=" * 50 + "\n\n")
         
         # 遍历所有会话，生成格式化的文本报告
         for session in status['sessions']:
             # 会话头部：显示会话名和连接状态
-            snapshot += f"Session: {session['name']} ({'ATTACHED' if session['attached'] else 'DETACHED'})\n"
-            snapshot += "-" * 30 + "\n"  # 分隔线
+            buf.write(f"Session: {session['name']} ({'ATTACHED' if session['attached'] else 'DETACHED'})\n")
+            buf.write("-" * 30 + "\n")  # 分隔线
             
             # 窗口列表：显示每个窗口的基本信息
             for window in session['windows']:
-                snapshot += f"  Window {window['index']}: {window['name']}"
+                buf.write(f"  Window {window['index']}: {window['name']}")
                 if window['active']:  # 标记当前活跃窗口
-                    snapshot += " (ACTIVE)"
-                snapshot += "\n"
+                    buf.write(" (ACTIVE)")
+                buf.write("\n")
                 
                 # 如果窗口有内容，显示最近的输出
                 if 'content' in window['info']:
                     # 只显示最后10行，避免信息过载
-                    content_lines = window['info']['content'].split('\n')
-                    recent_lines = content_lines[-10:] if len(content_lines) > 10 else content_lines
-                    snapshot += "    Recent output:\n"
+                    # rsplit 从末尾开始只切分出需要的行，不必拆分整段内容
+                    recent_lines = window['info']['content'].rsplit('\n', 10)[-10:]
+                    buf.write("    Recent output:\n")
                     for line in recent_lines:
                         if line.strip():  # 过滤空行，只显示有内容的行
-                            snapshot += f"    | {line}\n"  # 使用 '|' 作为缩进标记
-                snapshot += "\n"  # 窗口间的分隔
+                            buf.write(f"    | {line}\n")  # 使用 '|' 作为缩进标记
+                buf.write("\n")  # 窗口间的分隔
         
-        return snapshot
+        return buf.getvalue()
+
+class AsyncTmuxOrchestrator:
+    """
+    基于 asyncio 的只读 tmux 编排器
+    
+    与 TmuxOrchestrator 提供相同的状态查询接口，但所有 tmux 调用都通过
+    asyncio.create_subprocess_exec 发起，不会阻塞事件循环。
+    get_all_windows_status 会并发地查询所有窗口，窗口越多收益越明显。
+    
+    发送按键等写操作仍由 TmuxOrchestrator 负责（需要交互式确认）。
+    
+    并发控制:
+        同时运行的 tmux 子进程数量受 max_concurrency 限制，即使一次查询
+        数百个窗口，也只会保持固定数量的子进程，避免压垮 tmux 服务端。
+        限制按事件循环分别计算：asyncio.Semaphore 会绑定到第一个使用它的事件循环，
+        因此每个事件循环使用各自的信号量，同一个实例可以在多次 asyncio.run 中复用。
+    
+    取消与超时:
+        - 本类不内置超时，调用方可使用 asyncio.wait_for 为任意方法设置超时
+        - 等待中的调用被取消时会立即让出并发名额，不会启动子进程
+        - 已启动的调用被取消时会终止对应的 tmux 子进程并回收，然后继续
+          抛出 CancelledError，不会遗留僵尸进程
+    
+    使用示例:
+        status = asyncio.run(AsyncTmuxOrchestrator().get_all_windows_status())
+    """
+    
+    def __init__(self, max_concurrency: int = 16):
+        """
+        参数:
+            max_concurrency (int): 同时运行的 tmux 子进程数量上限，默认 16
+        """
+        self.max_lines_capture = 1000  # 与 TmuxOrchestrator 保持一致的捕获行数上限
+        self.max_concurrency = max_concurrency
+        # 事件循环 -> 该循环使用的信号量；弱引用键，事件循环关闭回收后条目自动删除
+        self._sems: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = \
+            weakref.WeakKeyDictionary()
+    
+    def _semaphore(self) -> asyncio.Semaphore:
+        """返回当前事件循环使用的并发信号量，首次使用时创建"""
+        loop = asyncio.get_running_loop()
+        sem = self._sems.get(loop)
+        if sem is None:
+            sem = self._sems[loop] = asyncio.Semaphore(self.max_concurrency)
+        return sem
+    
+    async def _run(self, *args: str) -> str:
+        """
+        异步执行一条 tmux 命令并返回其标准输出
+        
+        异常:
+            subprocess.CalledProcessError: tmux 以非零状态码退出时抛出，
+            与同步版本中 subprocess.run(check=True) 的行为保持一致
+        """
+        async with self._semaphore():
+            proc = await asyncio.create_subprocess_exec(
+                "tmux", *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+            try:
+                stdout, stderr = await proc.communicate()
+            except asyncio.CancelledError:
+                # 调用被取消（包括 wait_for 超时）：终止子进程，避免其继续占用资源
+                proc.kill()
+                await proc.wait()
+                raise
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, ["tmux", *args], stdout, stderr)
+        return stdout.decode()
+    
+    async def get_tmux_sessions(self) -> List[TmuxSession]:
+        """获取所有 tmux 会话和窗口信息，出错时返回空列表"""
+        try:
+            return SnapshotTable.parse(await self._run("list-windows", "-a", "-F", _WINDOWS_FORMAT)).sessions()
+        except subprocess.CalledProcessError as e:
+            print(f"Error getting tmux sessions: {e}")
+            return []
+    
+    async def capture_window_content(self, session_name: str, window_index: int, num_lines: int = 50) -> str:
+        """捕获窗口最近 num_lines 行内容，出错时返回错误信息"""
+        # 安全限制：防止请求过多行数导致内存问题
+        num_lines = min(num_lines, self.max_lines_capture)
+        try:
+            return await self._run("capture-pane", "-t", f"{session_name}:{window_index}", "-p", "-S", f"-{num_lines}")
+        except subprocess.CalledProcessError as e:
+            return f"Error capturing window content: {e}"
+    
+    async def get_window_info(self, session_name: str, window_index: int, num_lines: int = 50) -> Optional[Dict]:
+        """获取单个窗口的详细信息（包含最近 num_lines 行内容快照）"""
+        try:
+            output = await self._run("display-message", "-t", f"{session_name}:{window_index}", "-p", _WINDOW_INFO_FORMAT)
+        except subprocess.CalledProcessError as e:
+            return {"error": f"Could not get window info: {e}"}
+        
+        info = _parse_window_info(output)
+        if info is not None:
+            info["content"] = await self.capture_window_content(session_name, window_index, num_lines)
+        return info
+    
+    async def get_all_windows_status(self, num_lines: int = 50) -> Dict:
+        """
+        获取所有窗口的完整状态，返回结构与 TmuxOrchestrator.get_all_windows_status 相同
+        
+        所有窗口的 get_window_info 通过 asyncio.gather 并发执行，
+        总耗时接近单个窗口的查询耗时，而不是随窗口数线性增长。
+        """
+        sessions = await self.get_tmux_sessions()
+        timestamp = datetime.now().isoformat()
+        
+        # 并发查询所有窗口，结果顺序与传入顺序一致
+        windows = [window for session in sessions for window in session.windows]
+        infos = iter(await asyncio.gather(
+            *[self.get_window_info(window.session_name, window.window_index, num_lines) for window in windows]))
+        
+        return {
+            "timestamp": timestamp,
+            "sessions": [
+                {
+                    "name": session.name,
+                    "attached": session.attached,
+                    "windows": [
+                        {
+                            "index": window.window_index,
+                            "id": window.window_id,
+                            "name": window.window_name,
+                            "active": window.active,
+                            "info": next(infos)
+                        }
+                        for window in session.windows
+                    ]
+                }
+                for session in sessions
+            ]
+        }
+
 
 def main():
     """
@@ -462,10 +1537,15 @@ def main():
     
     当直接运行此脚本时，会展示系统的基本功能：
     获取并打印所有 tmux 会话的状态信息。
+    
+    安装了 orjson 时使用它直接输出 UTF-8 字节，否则使用标准库 json。
     """
     orchestrator = TmuxOrchestrator()
     status = orchestrator.get_all_windows_status()
-    print(json.dumps(status, indent=2))
+    if orjson is not None:
+        sys.stdout.buffer.write(orjson.dumps(status, option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE))
+    else:
+        print(json.dumps(status, indent=2))
 
 
 # ============================================================================
@@ -524,6 +1604,12 @@ def main():
     commands = ["cd /home/user", "python script.py", "exit"]
     for cmd in commands:
         orchestrator.send_command_to_window("automation", 0, cmd, confirm=False)
+    
+    # 保持安全模式的批量操作：排队后只确认一次
+    orchestrator.safety_mode = True
+    for cmd in commands:
+        orchestrator.queue("automation", 0, cmd)
+    orchestrator.flush()
     ```
 
 4. AI 代理协调 - 多代理管理
@@ -601,7 +1687,7 @@ def main():
 
 6. 扩展开发建议：
    - 继承 TmuxOrchestrator 类添加专用功能
-   - 使用数据类扩展窗口和会话信息
+   - 扩展窗口和会话信息时保持 NamedTuple 的不可变形式
    - 集成消息队列实现异步通信
    - 添加 Web 界面进行可视化监控
 """